@@ -8,10 +8,11 @@ from discord import (ApplicationContext, Bot, IntegrationType, Intents,
 from tortoise import Tortoise, connections
 from tortoise.queryset import Q
 
-from utils.checks import check_admin, check_allowed
+from utils.checks import check_admin, check_allowed, check_duration
 from utils.config import Config
 from utils.controller import Controller
-from utils.models import Connection
+from utils.models import Connection, upgrade_schema
+from utils.scheduler import parse_duration
 
 basicConfig(
     level=INFO,
@@ -30,6 +31,7 @@ client = Bot(
     default_command_integration_types={IntegrationType.guild_install},
 )
 controller = Controller(client, config)
+tracer = controller.tracer
 
 admin_group = client.create_group(
     "admin",
@@ -50,15 +52,16 @@ admin_group = client.create_group(
     required=False,
 )
 async def minecraft(ctx: ApplicationContext, username: Optional[str]) -> Any:
-    if await check_allowed(ctx, config):
-        return
+    with tracer.trace("/minecraft"):
+        if await check_allowed(ctx, config):
+            return
 
-    await ctx.defer(ephemeral=True)
-    if username is None:
-        return await controller.whitelist_remove(
-            ctx, ctx.author, "Your Discord account connection has been removed."
-        )
-    await controller.whitelist_add(ctx, username)
+        await controller.defer(ctx)
+        if username is None:
+            return await controller.whitelist_remove(
+                ctx, ctx.author, "Your Discord account connection has been removed."
+            )
+        await controller.whitelist_add(ctx, username)
 
 
 @admin_group.command(name="check", description="Check the user data.")
@@ -69,15 +72,17 @@ async def minecraft(ctx: ApplicationContext, username: Optional[str]) -> Any:
     max_length=16,
     type=str,
     required=False,
+    autocomplete=controller.username_autocomplete,
 )
 async def check(
     ctx: ApplicationContext, user: Optional[User], username: Optional[str]
 ) -> Any:
-    if await check_admin(ctx, user, username):
-        return
+    with tracer.trace("/admin check"):
+        if await check_admin(ctx, user, username):
+            return
 
-    await ctx.defer(ephemeral=True)
-    await controller.user_check(ctx, user or username)
+        await controller.defer(ctx)
+        await controller.user_check(ctx, user or username)
 
 
 @admin_group.command(name="ban", description="Ban user from the server.")
@@ -88,6 +93,7 @@ async def check(
     max_length=16,
     type=str,
     required=False,
+    autocomplete=controller.username_autocomplete,
 )
 @option(
     name="reason",
@@ -96,17 +102,33 @@ async def check(
     type=str,
     required=False,
 )
+@option(
+    name="duration",
+    description="Ban duration (e.g. 30m, 12h, 7d, 2w), permanent if not set.",
+    max_length=16,
+    type=str,
+    required=False,
+)
 async def ban(
     ctx: ApplicationContext,
     user: Optional[User],
     username: Optional[str],
     reason: Optional[str],
+    duration: Optional[str],
 ) -> Any:
-    if await check_admin(ctx, user, username):
-        return
-
-    await ctx.defer(ephemeral=True)
-    await controller.user_ban(ctx, user or username, reason)
+    with tracer.trace("/admin ban"):
+        if await check_admin(ctx, user, username):
+            return
+        if await check_duration(ctx, duration):
+            return
+
+        await controller.defer(ctx)
+        await controller.user_ban(
+            ctx,
+            user or username,
+            reason,
+            parse_duration(duration) if duration else None,
+        )
 
 
 @admin_group.command(name="unban", description="Ban user from the server.")
@@ -117,17 +139,19 @@ async def ban(
     max_length=16,
     type=str,
     required=False,
+    autocomplete=controller.username_autocomplete,
 )
 async def unban(
     ctx: ApplicationContext,
     user: Optional[User],
     username: Optional[str],
 ) -> Any:
-    if await check_admin(ctx, user, username):
-        return
+    with tracer.trace("/admin unban"):
+        if await check_admin(ctx, user, username):
+            return
 
-    await ctx.defer(ephemeral=True)
-    await controller.user_unban(ctx, user or username)
+        await controller.defer(ctx)
+        await controller.user_unban(ctx, user or username)
 
 
 @admin_group.command(name="remove", description="Remove user from the whitelist.")
@@ -138,6 +162,7 @@ async def unban(
     max_length=16,
     type=str,
     required=False,
+    autocomplete=controller.username_autocomplete,
 )
 @option(
     name="reason",
@@ -153,11 +178,54 @@ async def remove(
     username: Optional[str],
     reason: Optional[str],
 ) -> Any:
-    if await check_admin(ctx, user, username):
-        return
+    with tracer.trace("/admin remove"):
+        if await check_admin(ctx, user, username):
+            return
 
-    await ctx.defer(ephemeral=True)
-    await controller.whitelist_remove(ctx, user or username, reason)
+        await controller.defer(ctx)
+        await controller.whitelist_remove(ctx, user or username, reason)
+
+
+@admin_group.command(name="whitelist", description="Grant user whitelist access.")
+@option(name="user", description="Provide Discord user.", type=User)
+@option(
+    name="username",
+    description="Provide Minecraft username.",
+    max_length=16,
+    type=str,
+)
+@option(
+    name="duration",
+    description="Access duration (e.g. 30m, 12h, 7d, 2w), permanent if not set.",
+    max_length=16,
+    type=str,
+    required=False,
+)
+async def whitelist(
+    ctx: ApplicationContext,
+    user: User,
+    username: str,
+    duration: Optional[str],
+) -> Any:
+    with tracer.trace("/admin whitelist"):
+        if await check_duration(ctx, duration):
+            return
+
+        await controller.defer(ctx)
+        await controller.whitelist_grant(
+            ctx, user, username, parse_duration(duration) if duration else None
+        )
+
+
+@admin_group.command(
+    name="sync", description="Rewrite the whitelist file and reload it."
+)
+async def sync(
+    ctx: ApplicationContext,
+) -> Any:
+    with tracer.trace("/admin sync"):
+        await controller.defer(ctx)
+        await controller.whitelist_sync(ctx)
 
 
 @admin_group.command(
@@ -166,9 +234,10 @@ async def remove(
 async def restart(
     ctx: ApplicationContext,
 ) -> Any:
-    await ctx.defer(ephemeral=True)
-    await controller.connect()
-    await ctx.respond("🔄 Connection restarted!")
+    with tracer.trace("/admin restart"):
+        await controller.defer(ctx)
+        await controller.connect()
+        await controller.respond(ctx, "🔄 Connection restarted!")
 
 
 if config.admin_commands:
@@ -182,8 +251,15 @@ if config.admin_commands:
     )
     @default_permissions(administrator=True)
     async def root(ctx: ApplicationContext, command: str) -> Any:
-        await ctx.defer(ephemeral=True)
-        await controller.command(ctx, command)
+        with tracer.trace("/root"):
+            await controller.defer(ctx)
+            await controller.command(ctx, command)
+
+
+@client.listen("on_ready", once=True)
+async def schedule_expirations() -> None:
+    # Expirations log to Discord, so they must not fire before login.
+    await controller.schedule_expirations()
 
 
 expire_future: Optional[Future] = None
@@ -203,11 +279,12 @@ if config.expires and config.guild is not None:
                         )
                     ):
                         try:
-                            await controller.whitelist_remove(
-                                None,
-                                connection.username,
-                                "Membership has expired. Access has been revoked.",
-                            )
+                            with tracer.trace("expire membership"):
+                                await controller.whitelist_remove(
+                                    None,
+                                    connection.username,
+                                    "Membership has expired. Access has been revoked.",
+                                )
                         except Exception as e:
                             error(f"Error in expire check: {e}")
             await sleep(config.check_interval)
@@ -219,8 +296,12 @@ if config.expires and config.guild is not None:
 
 
 async def start() -> None:
-    await Tortoise.init(db_url="sqlite://main.db", modules={"models": ["utils.models"]})
+    await Tortoise.init(
+        db_url=config.database_url, modules={"models": ["utils.models"]}
+    )
+    await upgrade_schema()
     await Tortoise.generate_schemas()
+    await controller.index_usernames()
     await controller.connect()
     await client.start(config.bot_token)
 
@@ -0,0 +1,77 @@
+from argparse import ArgumentParser, ArgumentTypeError
+from asyncio import run
+from logging import INFO, basicConfig, error, info
+from os import getenv
+from pathlib import Path
+
+from dotenv import load_dotenv
+from tortoise import Tortoise, connections
+
+from utils.models import upgrade_schema
+from utils.transfer import (Conflict, ConflictError, export_connections,
+                            import_connections, read_csv, read_jsonl)
+
+basicConfig(
+    level=INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+load_dotenv(override=True)
+
+
+def chunk_size(value: str) -> int:
+    if (size := int(value)) < 1:
+        raise ArgumentTypeError("must be at least 1")
+    return size
+
+
+parser = ArgumentParser(description="Export or import the bot's connections.")
+parser.add_argument("action", choices=["export", "import"])
+parser.add_argument("path", type=Path, help="JSONL or CSV file to write or read.")
+parser.add_argument(
+    "--format",
+    choices=["jsonl", "csv"],
+    help="File format, inferred from the file extension if not set.",
+)
+parser.add_argument(
+    "--db",
+    default=getenv("DATABASE_URL", "sqlite://main.db"),
+    help="Database URL, defaults to DATABASE_URL or sqlite://main.db.",
+)
+parser.add_argument("--chunk-size", type=chunk_size, default=1000)
+parser.add_argument(
+    "--on-conflict",
+    choices=[conflict.value for conflict in Conflict],
+    default=Conflict.SKIP.value,
+    help="What to do with rows whose Discord user already exists.",
+)
+
+
+async def main() -> None:
+    args = parser.parse_args()
+    fmt = args.format or ("csv" if args.path.suffix == ".csv" else "jsonl")
+
+    await Tortoise.init(db_url=args.db, modules={"models": ["utils.models"]})
+    await upgrade_schema()
+    await Tortoise.generate_schemas()
+    try:
+        if args.action == "export":
+            with open(args.path, "w", encoding="utf-8", newline="") as file:
+                count = await export_connections(file, fmt, args.chunk_size)
+            info(f"Exported {count} connections to {args.path}.")
+        else:
+            with open(args.path, encoding="utf-8", newline="") as file:
+                rows = read_csv(file) if fmt == "csv" else read_jsonl(file)
+                created, updated, skipped = await import_connections(
+                    rows, args.chunk_size, Conflict(args.on_conflict)
+                )
+            info(
+                f"Imported {args.path}: {created} created, "
+                f"{updated} updated, {skipped} skipped."
+            )
+    except ConflictError as e:
+        error(f"Import stopped, batches before the conflict were kept: {e}")
+    finally:
+        await connections.close_all()
+
+
+run(main())
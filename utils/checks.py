@@ -3,6 +3,7 @@ from typing import Any, Optional
 from discord import ApplicationContext, User
 
 from utils.config import Config
+from utils.scheduler import parse_duration
 
 
 async def check_allowed(ctx: ApplicationContext, config: Config) -> Any:
@@ -21,3 +22,11 @@ async def check_admin(
         return await ctx.respond(
             "❌ You have to provide Discord user or Minecraft username.", ephemeral=True
         )
+
+
+async def check_duration(ctx: ApplicationContext, duration: Optional[str]) -> Any:
+    if duration and not parse_duration(duration):
+        return await ctx.respond(
+            "❌ Invalid duration, use e.g. `30m`, `12h`, `7d` or `2w` (up to 10 years).",
+            ephemeral=True,
+        )
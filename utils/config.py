@@ -1,4 +1,5 @@
 from os import getenv
+from os.path import isdir
 from typing import Optional
 
 from dotenv import load_dotenv
@@ -18,6 +19,8 @@ class Config:
         if self.password is None or self.host is None:
             raise ValueError("HOST or PASSWORT environment variable not set")
 
+        self.database_url: str = getenv("DATABASE_URL", "sqlite://main.db")
+
         self.port: int = 25575
         if port := getenv("PORT"):
             if not port.isdigit():
@@ -64,3 +67,22 @@ class Config:
             if not logs_channel.isdigit():
                 raise ValueError("Invalid check LOGS_CHANNEL")
             self.logs_channel = int(logs_channel)
+
+        self.trace_threshold: int = 1000
+        if trace_threshold := getenv("TRACE_THRESHOLD"):
+            if not trace_threshold.isdigit():
+                raise ValueError("Invalid TRACE_THRESHOLD")
+            self.trace_threshold = int(trace_threshold)
+
+        self.trace_export: Optional[str] = getenv("TRACE_EXPORT") or None
+
+        self.server_dir: Optional[str] = None
+        if server_dir := getenv("SERVER_DIR"):
+            if not isdir(server_dir):
+                raise ValueError("Invalid SERVER_DIR")
+            self.server_dir = server_dir
+
+        self.online_mode: bool = True
+        if online_mode := getenv("ONLINE_MODE"):
+            if online_mode.lower() == "false":
+                self.online_mode = False
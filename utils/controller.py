@@ -1,13 +1,21 @@
+from datetime import datetime, timedelta
 from logging import error
-from typing import Any, Optional, Union
+from typing import Any, List, Optional, Type, Union
 
-from discord import ApplicationContext, Bot, Color, Embed, HTTPException, User
+from discord import (ApplicationContext, AutocompleteContext, Bot, Color, Embed,
+                     HTTPException, User)
+from discord.utils import format_dt
+from tortoise import timezone
 from tortoise.queryset import Q
+from tortoise.signals import post_delete, post_save
 
 from utils.config import Config
+from utils.index import PrefixIndex
 from utils.minecraft import MinecraftController
 from utils.models import Connection
 from utils.rcon import TLSMode
+from utils.scheduler import Scheduler
+from utils.tracing import Tracer, span
 from utils.views import ConfirmView
 
 
@@ -17,26 +25,87 @@ class Controller:
     ) -> None:
         self.client = client
         self.config = config
-        self._mc_controller = MinecraftController(config, tls_mode)
+        self.tracer = Tracer(config)
+        self._mc_controller = MinecraftController(config, tls_mode, self.tracer)
+        self._scheduler = Scheduler(self.expire)
+
+        self.usernames = PrefixIndex()
+        post_save(Connection)(self.on_connection_save)
+        post_delete(Connection)(self.on_connection_delete)
 
     async def connect(self) -> None:
         await self._mc_controller.connect()
 
     async def close(self) -> None:
+        await self._scheduler.close()
         if not self._mc_controller.is_closed:
             await self._mc_controller.close()
+        await self.tracer.close()
+
+    async def schedule_expirations(self) -> None:
+        for connection in await Connection.filter(
+            Q(expires_at__isnull=False) | Q(ban_expires_at__isnull=False)
+        ):
+            self.schedule(connection)
+        self._scheduler.start()
+
+    async def index_usernames(self) -> None:
+        for connection_id, username in await Connection.filter(
+            ~Q(username=None)
+        ).values_list("id", "username"):
+            self.usernames.add(connection_id, username)
+
+    async def on_connection_save(
+        self, _: Type[Connection], connection: Connection, *args: Any
+    ) -> None:
+        self.usernames.add(connection.id, connection.username)
+        self._mc_controller.request_sync()
+
+    async def on_connection_delete(
+        self, _: Type[Connection], connection: Connection, *args: Any
+    ) -> None:
+        self.usernames.remove(connection.id)
+        self._mc_controller.request_sync()
+
+    async def username_autocomplete(self, ctx: AutocompleteContext) -> List[str]:
+        return self.usernames.search(ctx.value or "")
+
+    def get_deadline(self, connection: Connection) -> Optional[datetime]:
+        if connection.is_banned:
+            return connection.ban_expires_at
+        return connection.expires_at
+
+    def schedule(self, connection: Connection) -> None:
+        if deadline := self.get_deadline(connection):
+            self._scheduler.schedule(connection.id, deadline)
+        else:
+            self._scheduler.cancel(connection.id)
 
     def get_avatar(self, username: str) -> str:
         return f"https://mineskin.eu/armor/body/{username}/100.png"
 
+    async def defer(self, ctx: ApplicationContext) -> None:
+        with span("discord defer"):
+            await ctx.defer(ephemeral=True)
+
+    async def respond(self, ctx: ApplicationContext, *args: Any, **kwargs: Any) -> Any:
+        with span("discord respond"):
+            return await ctx.respond(*args, **kwargs)
+
+    async def get_connection(self, user: Union[User, str]) -> Optional[Connection]:
+        filters = {"username": user} if isinstance(user, str) else {"user_id": user.id}
+        with span("db get connection"):
+            return await Connection.get_or_none(**filters)
+
     async def log_action(self, ctx: Optional[ApplicationContext], embed: Embed) -> None:
         if logs_channel := self.config.logs_channel:
             if logs_channel := self.client.get_channel(logs_channel):
                 try:
-                    await logs_channel.send(
-                        content=f"## Executed by {ctx.author.mention if ctx else '` System `'}",
-                        embed=embed,
-                    )
+                    with span("discord log action"):
+                        await logs_channel.send(
+                            content=f"## Executed by {ctx.author.mention if ctx else '` System `'}",
+                            embed=embed,
+                        )
                 except HTTPException:
                     error(f"Failed to send log message to {logs_channel}.")
 
@@ -48,21 +117,43 @@ class Controller:
         if len(result) > 1016:
             embed.set_footer(text="The result is too long to display in full.")
         await self.log_action(ctx, embed)
-        await ctx.respond(embed=embed)
+        await self.respond(ctx, embed=embed)
+
+    async def whitelist_sync(self, ctx: ApplicationContext) -> Any:
+        if not self._mc_controller.is_file_mode:
+            return await self.respond(ctx, "❌ Whitelist file mode is not enabled.")
+
+        try:
+            count = await self._mc_controller.sync_whitelist()
+        except Exception as e:
+            error(f"Error in whitelist sync: {e}")
+            return await self.respond(ctx, "❌ Whitelist sync failed, check the logs.")
+
+        embed = Embed(title="Whitelist synced", color=Color.blurple())
+        embed.add_field(name="Players", value=str(count))
+        await self.log_action(ctx, embed)
+        await self.respond(ctx, embed=embed)
 
     async def whitelist_add(self, ctx: ApplicationContext, username: str) -> Any:
-        if await Connection.exists(~Q(user_id=ctx.author.id) & Q(username=username)):
-            return await ctx.respond(
-                "❌ Your username is already taken, please contact admin."
+        with span("db check username"):
+            taken = await Connection.exists(
+                ~Q(user_id=ctx.author.id) & Q(username=username)
+            )
+        if taken:
+            return await self.respond(
+                ctx,
+                "❌ Your username is already taken, please contact admin.",
             )
 
-        if connection := await Connection.get_or_none(user_id=ctx.author.id):
+        if connection := await self.get_connection(ctx.author):
             if connection.is_banned:
-                return await ctx.respond("❌ You're banned from the server.")
+                return await self.respond(ctx, "❌ You're banned from the server.")
             if connection.username == username:
                 await self._mc_controller.whitelist_add(username)
-                return await ctx.respond(
-                    "❌ Your username is already whitelisted - re-added connection."
+                self._mc_controller.request_sync()
+                return await self.respond(
+                    ctx,
+                    "❌ Your username is already whitelisted - re-added connection.",
                 )
 
             await self._mc_controller.whitelist_remove(
@@ -78,20 +169,22 @@ class Controller:
             embed.set_thumbnail(url=self.get_avatar(username))
 
             connection.username = username
-            await connection.save()
+            with span("db save connection"):
+                await connection.save()
 
             await self.log_action(ctx, embed)
-            return await ctx.respond(embed=embed)
+            return await self.respond(ctx, embed=embed)
 
         await self._mc_controller.whitelist_add(username)
-        await Connection.create(user_id=ctx.author.id, username=username)
+        with span("db create connection"):
+            await Connection.create(user_id=ctx.author.id, username=username)
 
         embed = Embed(title="Whitelist user added", color=Color.brand_green())
         embed.add_field(name="Discord", value=ctx.author.mention)
         embed.add_field(name="Minecraft", value=username)
         embed.set_thumbnail(url=self.get_avatar(username))
         await self.log_action(ctx, embed)
-        await ctx.respond(embed=embed)
+        await self.respond(ctx, embed=embed)
 
     async def whitelist_remove(
         self,
@@ -99,12 +192,11 @@ class Controller:
         user: Union[User, str],
         reason: Optional[str] = None,
     ) -> Any:
-        filters = {"username": user} if isinstance(user, str) else {"user_id": user.id}
-        connection = await Connection.get_or_none(**filters)
+        connection = await self.get_connection(user)
 
         if not isinstance(user, str) and (not connection or not connection.username):
             if ctx:
-                await ctx.respond("❌ User not found!")
+                await self.respond(ctx, "❌ User not found!")
             return
 
         username = user if isinstance(user, str) else connection.username
@@ -114,7 +206,11 @@ class Controller:
         if connection:
             embed.add_field(name="Discord", value=f"<@{connection.user_id}>")
             if not connection.is_banned:
-                await connection.delete()
+                with span("db delete connection"):
+                    await connection.delete()
+                self._scheduler.cancel(connection.id)
+        # Flushes the queued kick when no row was deleted.
+        self._mc_controller.request_sync()
 
         embed.add_field(name="Minecraft", value=username)
         embed.add_field(
@@ -122,14 +218,13 @@ class Controller:
         )
         await self.log_action(ctx, embed)
         if ctx:
-            await ctx.respond(embed=embed)
+            await self.respond(ctx, embed=embed)
 
     async def user_check(self, ctx: ApplicationContext, user: Union[User, str]) -> Any:
-        filters = {"username": user} if isinstance(user, str) else {"user_id": user.id}
-        connection = await Connection.get_or_none(**filters)
+        connection = await self.get_connection(user)
 
         if not connection:
-            return await ctx.respond("❌ User not found!")
+            return await self.respond(ctx, "❌ User not found!")
 
         user_id = connection.user_id
         username = connection.username
@@ -138,31 +233,46 @@ class Controller:
         embed = Embed(title="User check", color=Color.blurple())
         embed.add_field(name="Discord", value=f"<@{user_id}>")
         embed.add_field(name="Minecraft", value=f"{username or 'Not set'}")
+        if connection.expires_at:
+            embed.add_field(name="Expires", value=format_dt(connection.expires_at, "R"))
+        if connection.ban_expires_at:
+            embed.add_field(
+                name="Ban expires", value=format_dt(connection.ban_expires_at, "R")
+            )
         if connection.is_banned:
             embed.add_field(
                 name="Ban reason",
                 value=ban_reason or "No reason provided.",
                 inline=False,
             )
-        await ctx.respond(embed=embed)
+        await self.respond(ctx, embed=embed)
 
     async def user_ban(
         self,
         ctx: ApplicationContext,
         user: Union[User, str],
         reason: Optional[str] = None,
+        duration: Optional[timedelta] = None,
     ) -> Any:
-        filters = {"username": user} if isinstance(user, str) else {"user_id": user.id}
-        connection = await Connection.get_or_none(**filters)
+        connection = await self.get_connection(user)
+        ban_expires_at = timezone.now() + duration if duration else None
 
         if not connection:
             if isinstance(user, str):
+                if ban_expires_at:
+                    return await self.respond(
+                        ctx, "❌ Temporary bans require a connected user."
+                    )
+
                 view = ConfirmView(ctx.author)
-                await ctx.respond(
+                await self.respond(
+                    ctx,
                     "Connected user not found, continue with only Minecraft ban?",
                     view=view,
                 )
-                if not await view.wait():
+                with span("discord confirm"):
+                    timed_out = await view.wait()
+                if not timed_out:
                     await self._mc_controller.ban_add(user, reason)
                     embed = Embed(title="User ban", color=Color.brand_red())
                     embed.add_field(name="Minecraft", value=user)
@@ -170,20 +280,27 @@ class Controller:
                     await ctx.followup.send(embed=embed, ephemeral=True)
                 return
 
-            connection = await Connection.create(
-                user_id=user.id, is_banned=True, ban_reason=reason
-            )
+            with span("db create connection"):
+                connection = await Connection.create(
+                    user_id=user.id,
+                    is_banned=True,
+                    ban_reason=reason,
+                    ban_expires_at=ban_expires_at,
+                )
             embed = Embed(title="User ban", color=Color.brand_red())
             embed.add_field(name="Discord", value=f"<@{user.id}>")
             embed.add_field(
                 name="Reason", value=reason or "No reason provided.", inline=False
             )
             await self.log_action(ctx, embed)
-            await ctx.respond(embed=embed)
+            await self.respond(ctx, embed=embed)
 
         connection.is_banned = True
         connection.ban_reason = reason
-        await connection.save()
+        connection.ban_expires_at = ban_expires_at
+        with span("db save connection"):
+            await connection.save()
+        self.schedule(connection)
 
         user_id = connection.user_id
         username = connection.username
@@ -193,51 +310,148 @@ class Controller:
         embed = Embed(title="User ban", color=Color.brand_red())
         embed.add_field(name="Discord", value=f"<@{user_id}>")
         embed.add_field(name="Minecraft", value=f"{username or 'Not set'}")
+        if ban_expires_at:
+            embed.add_field(name="Expires", value=format_dt(ban_expires_at, "R"))
         await self.log_action(ctx, embed)
-        await ctx.respond(embed=embed)
+        await self.respond(ctx, embed=embed)
 
     async def user_unban(
         self,
         ctx: ApplicationContext,
         user: Union[User, str],
     ) -> Any:
-        filters = {"username": user} if isinstance(user, str) else {"user_id": user.id}
-        connection = await Connection.get_or_none(**filters)
+        connection = await self.get_connection(user)
 
         if not connection:
             if isinstance(user, str):
+                # The whitelist file is rebuilt from linked users only.
+                file_mode = self._mc_controller.is_file_mode
+                prompt = "Connected user not found, continue with only Minecraft unban?"
+                if file_mode:
+                    prompt += " The player won't be re-whitelisted in file mode."
+
                 view = ConfirmView(ctx.author)
-                await ctx.respond(
-                    "Connected user not found, continue with only Minecraft unban?",
-                    view=view,
-                )
-                if not await view.wait():
+                await self.respond(ctx, prompt, view=view)
+                with span("discord confirm"):
+                    timed_out = await view.wait()
+                if not timed_out:
                     await self._mc_controller.ban_remove(user)
-                    await self._mc_controller.whitelist_add(user)
+                    if not file_mode:
+                        await self._mc_controller.whitelist_add(user)
                     embed = Embed(title="User unban", color=Color.brand_green())
                     embed.add_field(name="Minecraft", value=user)
+                    if file_mode:
+                        embed.add_field(
+                            name="Whitelist",
+                            value="Not re-added, the player has no linked account.",
+                            inline=False,
+                        )
                     await self.log_action(ctx, embed)
                     await ctx.followup.send(embed=embed, ephemeral=True)
                 return
-            return await ctx.respond("❌ User not found!")
+            return await self.respond(ctx, "❌ User not found!")
 
+        embed = await self.unban(connection)
+        await self.log_action(ctx, embed)
+        await self.respond(ctx, embed=embed)
+
+    async def unban(self, connection: Connection) -> Embed:
         user_id = connection.user_id
         username = connection.username
+        # A whitelist grant that ran out during the ban is not restored.
+        expires_at = connection.expires_at
+        expired = expires_at is not None and expires_at <= timezone.now()
 
         if username:
             await self._mc_controller.ban_remove(username)
-            await self._mc_controller.whitelist_add(username)
+            if not expired:
+                await self._mc_controller.whitelist_add(username)
 
         embed = Embed(title="User unban", color=Color.brand_green())
         embed.add_field(name="Discord", value=f"<@{user_id}>")
         embed.add_field(name="Minecraft", value=f"{username or 'Not set'}")
+        if username and expired:
+            embed.add_field(
+                name="Whitelist",
+                value="Not re-added, the whitelist access has expired.",
+                inline=False,
+            )
 
-        if connection.username:
+        if username and not expired:
             connection.is_banned = False
             connection.ban_reason = None
-            await connection.save()
+            connection.ban_expires_at = None
+            with span("db save connection"):
+                await connection.save()
+            self.schedule(connection)
         else:
-            await connection.delete()
+            with span("db delete connection"):
+                await connection.delete()
+            self._scheduler.cancel(connection.id)
+        return embed
+
+    async def whitelist_grant(
+        self,
+        ctx: ApplicationContext,
+        user: User,
+        username: str,
+        duration: Optional[timedelta] = None,
+    ) -> Any:
+        with span("db check username"):
+            taken = await Connection.exists(~Q(user_id=user.id) & Q(username=username))
+        if taken:
+            return await self.respond(
+                ctx, "❌ Username is already taken by another user."
+            )
+
+        connection = await self.get_connection(user)
+        if connection and connection.is_banned:
+            return await self.respond(ctx, "❌ User is banned from the server.")
+
+        if connection and connection.username and connection.username != username:
+            await self._mc_controller.whitelist_remove(
+                connection.username, "Changed username"
+            )
+        await self._mc_controller.whitelist_add(username)
+
+        expires_at = timezone.now() + duration if duration else None
+        with span("db save connection"):
+            if connection:
+                connection.username = username
+                connection.expires_at = expires_at
+                await connection.save()
+            else:
+                connection = await Connection.create(
+                    user_id=user.id, username=username, expires_at=expires_at
+                )
+        self.schedule(connection)
 
+        embed = Embed(title="Whitelist user granted", color=Color.brand_green())
+        embed.add_field(name="Discord", value=user.mention)
+        embed.add_field(name="Minecraft", value=username)
+        embed.add_field(
+            name="Expires", value=format_dt(expires_at, "R") if expires_at else "Never"
+        )
+        embed.set_thumbnail(url=self.get_avatar(username))
         await self.log_action(ctx, embed)
-        await ctx.respond(embed=embed)
+        await self.respond(ctx, embed=embed)
+
+    async def expire(self, connection_id: int) -> None:
+        with self.tracer.trace("scheduled expiry"):
+            with span("db get connection"):
+                connection = await Connection.get_or_none(id=connection_id)
+            if not connection or not (deadline := self.get_deadline(connection)):
+                return
+            if deadline > timezone.now():
+                return self.schedule(connection)
+
+            if not connection.is_banned:
+                return await self.whitelist_remove(
+                    None, connection.username, "Whitelist access has expired."
+                )
+
+            embed = await self.unban(connection)
+            embed.add_field(
+                name="Reason", value="Temporary ban has expired.", inline=False
+            )
+            await self.log_action(None, embed)
@@ -0,0 +1,35 @@
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+
+class PrefixIndex:
+    def __init__(self) -> None:
+        self._keys: List[Tuple[str, int]] = []
+        self._values: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, key: int, value: Optional[str]) -> None:
+        if self._values.get(key) == value:
+            return
+        self.remove(key)
+        if value:
+            self._values[key] = value
+            insort(self._keys, (value.lower(), key))
+
+    def remove(self, key: int) -> None:
+        if value := self._values.pop(key, None):
+            del self._keys[bisect_left(self._keys, (value.lower(), key))]
+
+    def search(self, prefix: str, limit: int = 25) -> List[str]:
+        prefix = prefix.lower()
+        results = []
+        i = bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(results) < limit:
+            value, key = self._keys[i]
+            if not value.startswith(prefix):
+                break
+            results.append(self._values[key])
+            i += 1
+        return results
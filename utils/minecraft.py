@@ -1,44 +1,151 @@
-from asyncio import CancelledError, Future, Queue, ensure_future, sleep
+from asyncio import (CancelledError, Event, Future, Lock, Queue, ensure_future,
+                     get_running_loop, sleep)
 from logging import debug, error
-from typing import Any, Optional
+from re import MULTILINE, findall, search
+from time import perf_counter
+from typing import Any, List, Optional, Set, Tuple
 
 from utils.config import Config
 from utils.rcon import Rcon, TLSMode
+from utils.tracing import Tracer, current_trace, span
+from utils.whitelist import WhitelistFile
+
+SYNC_DELAY = 1
+
+
+def parse_command(command: str) -> Tuple[str, Optional[str]]:
+    words = command.lower().split()
+    if words[:1] == ["whitelist"]:
+        return " ".join(words[:2]), words[2] if len(words) > 2 else None
+    return " ".join(words[:1]), words[1] if len(words) > 1 else None
+
+
+def parse_whitelist(result: str) -> Set[str]:
+    _, _, names = result.partition(":")
+    return {name.lower() for name in findall(r"\w{1,16}", names)}
+
+
+def parse_banlist(result: str) -> Optional[Set[str]]:
+    if not (count := search(r"(\d+) ban", result)):
+        return set() if "no bans" in result else None
+    # Vanilla servers join ban entries without newlines, which can't be split
+    # reliably, so the ban state stays unknown unless every entry is found.
+    names = findall(r"^(\w{1,16}) was banned by", result, MULTILINE)
+    return {name.lower() for name in names} if len(names) == int(count[1]) else None
 
 
 class MinecraftController:
-    def __init__(self, config: Config, tls_mode: TLSMode = TLSMode.DISABLED) -> None:
+    def __init__(
+        self,
+        config: Config,
+        tls_mode: TLSMode = TLSMode.DISABLED,
+        tracer: Optional[Tracer] = None,
+    ) -> None:
         self.config = config
         self.tls_mode = tls_mode
+        self.tracer = tracer or Tracer(config)
 
         self._server: Optional[Rcon] = None
         self._future: Optional[Future] = None
         self._queue = Queue()
 
+        self._whitelist: Optional[Set[str]] = None
+        self._banned: Optional[Set[str]] = None
+
+        self._whitelist_file: Optional[WhitelistFile] = None
+        self._sync_future: Optional[Future] = None
+        self._sync_event = Event()
+        self._sync_lock = Lock()
+        self._sync_commands: List[str] = []
+        if config.server_dir:
+            self._whitelist_file = WhitelistFile(config)
+
     async def connect(self) -> None:
+        # Stop the worker first so no queued command shares the new socket
+        # with the state refresh.
+        if self._future:
+            self._future.cancel()
+            try:
+                await self._future
+            except CancelledError:
+                pass
+        await self.reconnect()
+        self._future = ensure_future(self.start())
+        if self._whitelist_file and not self._sync_future:
+            self._sync_future = ensure_future(self.sync_loop())
+
+    async def reconnect(self) -> None:
         if self._server:
             await self._server.disconnect()
         self._server = Rcon(
             self.config.host, self.config.password, self.config.port, self.tls_mode
         )
         await self._server.connect()
-        if self._future:
-            self._future.cancel()
-        self._future = ensure_future(self.start())
+        await self.refresh()
 
     async def start(self) -> None:
         while True:
+            command, queued_at, origin = await self._queue.get()
             try:
-                command = await self._queue.get()
-                result = await self.execute(command)
+                # Decided here rather than when queued, so the mirror already
+                # includes every command queued before this one.
+                if self.is_redundant(command):
+                    debug(f"MinecraftController skipped ({command})")
+                    continue
+                with self.tracer.trace(f"rcon {command}", queued_at, origin):
+                    with span("rcon queue wait", queued_at):
+                        pass
+                    with span("rcon execute"):
+                        result = await self.execute(command)
                 debug(f"MinecraftController nowait ({command}): {result}")
             except Exception as e:
                 error(f"Error in command execution: {e}")
-                await self.connect()
+                try:
+                    await self.reconnect()
+                except Exception as e:
+                    error(f"Error in reconnection: {e}")
             finally:
+                self._queue.task_done()
                 await sleep(0.05)
 
+    async def sync_loop(self) -> None:
+        while True:
+            await self._sync_event.wait()
+            # Coalesce a burst of whitelist changes into a single file write.
+            await sleep(SYNC_DELAY)
+            self._sync_event.clear()
+            try:
+                await self.sync_whitelist()
+            except Exception as e:
+                error(f"Error in whitelist sync: {e}")
+
+    async def sync_whitelist(self) -> int:
+        async with self._sync_lock:
+            commands, self._sync_commands = self._sync_commands, []
+            with span("whitelist file sync"):
+                count = await self._whitelist_file.sync()
+            await self.command("whitelist reload")
+            for command in commands:
+                await self.command(command)
+            return count
+
+    @property
+    def is_file_mode(self) -> bool:
+        return self._whitelist_file is not None
+
+    def request_sync(self) -> None:
+        if self.is_file_mode:
+            self._sync_event.set()
+
     async def close(self) -> None:
+        if self._sync_future:
+            self._sync_future.cancel()
+            try:
+                await self._sync_future
+            except CancelledError:
+                pass
+            if self._sync_event.is_set():
+                await self.sync_whitelist()
         await self._queue.join()
         if self._server:
             await self._server.disconnect()
@@ -53,29 +160,100 @@ class MinecraftController:
     def is_closed(self) -> bool:
         return self._future.cancelled() if self._future else True
 
+    async def refresh(self) -> None:
+        self._whitelist = self._banned = None
+        try:
+            self._whitelist = parse_whitelist(await self.execute("whitelist list"))
+            self._banned = parse_banlist(await self.execute("banlist players"))
+        except Exception as e:
+            error(f"Error in server state refresh: {e}")
+            # A partially read response would shift every later reply.
+            await self._server.disconnect()
+            await self._server.connect()
+
+    async def track(self, command: str, result: str) -> None:
+        action, username = parse_command(command)
+        if "does not exist" in result:
+            return
+
+        if action == "whitelist reload":
+            if self.is_file_mode:
+                entries = await get_running_loop().run_in_executor(
+                    None, self._whitelist_file.read
+                )
+                self._whitelist = set(entries)
+            else:
+                self._whitelist = parse_whitelist(await self.execute("whitelist list"))
+        elif username is None:
+            return
+        elif self._whitelist is not None and action == "whitelist add":
+            self._whitelist.add(username)
+        elif self._whitelist is not None and action == "whitelist remove":
+            self._whitelist.discard(username)
+        elif self._banned is not None and action == "ban":
+            self._banned.add(username)
+        elif self._banned is not None and action == "pardon":
+            self._banned.discard(username)
+
+    def is_redundant(self, command: str) -> bool:
+        action, username = parse_command(command)
+        if username is None:
+            return False
+        if action == "whitelist add":
+            return self.is_whitelisted(username) is True
+        if action == "whitelist remove":
+            return self.is_whitelisted(username) is False
+        if action == "ban":
+            return self.is_banned(username) is True
+        if action == "pardon":
+            return self.is_banned(username) is False
+        return False
+
+    def is_whitelisted(self, username: str) -> Optional[bool]:
+        if self._whitelist is None:
+            return None
+        return username.lower() in self._whitelist
+
+    def is_banned(self, username: str) -> Optional[bool]:
+        if self._banned is None:
+            return None
+        return username.lower() in self._banned
+
     async def execute(self, command: str) -> Any:
-        return await self._server.command(command)
+        result = await self._server.command(command)
+        await self.track(command, result)
+        return result
 
     async def command(self, command: str, wait: bool = False) -> Any:
         if wait:
-            result = await self.execute(command)
+            with span(f"rcon {command}"):
+                result = await self.execute(command)
             debug(f"MinecraftController wait ({command}): {result}")
             return result
-        await self._queue.put(command)
+        trace = current_trace()
+        with span(f"rcon enqueue {command}"):
+            await self._queue.put(
+                (command, perf_counter(), trace.name if trace else None)
+            )
 
     async def whitelist_add(self, username: str) -> None:
-        await self.command(f"whitelist add {username}")
+        # In file mode the whitelist is rebuilt once the connection is saved.
+        if not self.is_file_mode:
+            await self.command(f"whitelist add {username}")
 
     async def whitelist_remove(
         self, username: str, reason: Optional[str] = None
     ) -> None:
+        kick = f"kick {username} {reason if reason else 'No reason provided.'}"
+        if self.is_file_mode:
+            # Kick only once the reloaded whitelist keeps the player out.
+            return self._sync_commands.append(kick)
         await self.command(f"whitelist remove {username}")
-        await self.command(
-            f"kick {username} {reason if reason else 'No reason provided.'}"
-        )
+        await self.command(kick)
 
     async def ban_add(self, username: str, reason: Optional[str] = None) -> None:
-        await self.command(f"whitelist remove {username}")
+        if not self.is_file_mode:
+            await self.command(f"whitelist remove {username}")
         await self.command(
             f"ban {username} {reason if reason else 'No reason provided'}"
         )
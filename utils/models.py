@@ -1,15 +1,47 @@
-from tortoise import fields
+from logging import info
+
+from tortoise import connections, fields
+from tortoise.exceptions import OperationalError
 from tortoise.models import Model
 
 
 class Connection(Model):
     id = fields.IntField(pk=True)
 
-    user_id = fields.IntField()
+    user_id = fields.BigIntField()
     username = fields.CharField(null=True, max_length=16)
 
     is_banned = fields.BooleanField(default=False)
     ban_reason = fields.CharField(null=True, max_length=64)
 
+    expires_at = fields.DatetimeField(null=True, index=True)
+    ban_expires_at = fields.DatetimeField(null=True, index=True)
+
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
+
+
+async def upgrade_schema() -> None:
+    # Runs before generate_schemas(), which skips existing tables but would
+    # still try to index their missing columns.
+    client = connections.get("default")
+    table = Connection._meta.db_table
+    try:
+        await client.execute_query(f"SELECT id FROM {table} LIMIT 1")
+    except OperationalError:
+        return
+
+    generator = client.schema_generator(client)
+    for column in ("expires_at", "ban_expires_at"):
+        try:
+            await client.execute_query(f"SELECT {column} FROM {table} LIMIT 1")
+        except OperationalError:
+            field = Connection._meta.fields_map[column]
+            sql_type = field.get_for_dialect(client.capabilities.dialect, "SQL_TYPE")
+            # Same name as generate_schemas() uses, so it won't index it twice.
+            index = generator._generate_index_name("idx", Connection, [column])
+            await client.execute_script(
+                f"ALTER TABLE {table} ADD COLUMN {column} {sql_type} NULL"
+            )
+            await client.execute_script(f"CREATE INDEX {index} ON {table} ({column})")
+            info(f"Added column {column} to table {table}.")
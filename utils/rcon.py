@@ -3,7 +3,7 @@ from asyncio import (StreamReader, StreamWriter, TimeoutError, open_connection,
 from enum import Enum
 from ssl import CERT_NONE, create_default_context
 from struct import pack, unpack
-from typing import Optional
+from typing import Optional, Tuple
 
 
 class RconError(Exception):
@@ -16,7 +16,13 @@ class TLSMode(Enum):
     INSECURE = 2
 
 
+REQUEST_ID = 0
+END_ID = 1
+MAX_PAYLOAD = 4096
+
+
 class RconPacketType(Enum):
+    RESPONSE = 0
     COMMAND = 2
     AUTH = 3
 
@@ -64,32 +70,44 @@ class Rcon:
         except TimeoutError:
             raise RconError("Connection timeout error")
 
+    def _write(self, packet_id: int, packet_type: RconPacketType, data: str) -> None:
+        payload = pack("<ii", packet_id, packet_type.value) + data.encode()
+        payload += b"\x00\x00"
+        self.writer.write(pack("<i", len(payload)) + payload)
+
+    async def _receive(self) -> Tuple[int, bytes]:
+        length = unpack("<i", await self._read(4))[0]
+        payload = await self._read(length)
+        packet_id, _ = unpack("<ii", payload[:8])
+        return packet_id, payload[8:-2]
+
     async def _send(self, packet_type: RconPacketType, data: str) -> str:
         if not self.writer:
             raise RconError("Not connected")
 
-        payload = pack("<ii", 0, packet_type.value) + data.encode() + b"\x00\x00"
-        self.writer.write(pack("<i", len(payload)) + payload)
+        self._write(REQUEST_ID, packet_type, data)
+        await self.writer.drain()
+        packet_id, response = await self._receive()
+        if packet_id == -1:
+            raise RconError("Login failed")
+        if packet_type == RconPacketType.AUTH or len(response) < MAX_PAYLOAD:
+            return response.decode()
+
+        # Responses over 4096 bytes are split into several packets. The server
+        # answers packets in order, so the reply to a follow-up invalid packet
+        # marks the end of the command response. It is only sent once needed,
+        # since vanilla servers drop the connection when two packets arrive in
+        # a single read.
+        self._write(END_ID, RconPacketType.RESPONSE, "")
         await self.writer.drain()
 
-        response = ""
         while True:
-            length = unpack("<i", await self._read(4))[0]
-            payload = await self._read(length)
-            packet_id, packet_type = unpack("<ii", payload[:8])
-            response += payload[8:-2].decode()
-
+            packet_id, payload = await self._receive()
+            if packet_id == END_ID:
+                return response.decode()
             if packet_id == -1:
                 raise RconError("Login failed")
-            if self.reader.at_eof():
-                return response
-
-            try:
-                next_data = await wait_for(self.reader.read(1), timeout=1)
-                if not next_data:
-                    return response
-            except TimeoutError:
-                return response
+            response += payload
 
     async def command(self, command: str) -> str:
         return await self._send(RconPacketType.COMMAND, command)
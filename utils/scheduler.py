@@ -0,0 +1,81 @@
+from asyncio import (CancelledError, Event, Future, TimeoutError, ensure_future,
+                     wait_for)
+from datetime import datetime, timedelta
+from heapq import heappop, heappush
+from itertools import count
+from logging import error
+from re import fullmatch
+from time import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+DURATION_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+MAX_DURATION = timedelta(days=3650)
+
+
+def parse_duration(duration: str) -> Optional[timedelta]:
+    if match := fullmatch(r"(\d+)([mhdw])", duration.strip().lower()):
+        seconds = int(match[1]) * DURATION_UNITS[match[2]]
+        if 0 < seconds <= MAX_DURATION.total_seconds():
+            return timedelta(seconds=seconds)
+
+
+class Scheduler:
+    def __init__(self, callback: Callable[[int], Awaitable[Any]]) -> None:
+        self.callback = callback
+
+        self._heap: List[Tuple[float, int, int]] = []
+        self._deadlines: Dict[int, float] = {}
+        self._counter = count()
+        self._wakeup = Event()
+        self._future: Optional[Future] = None
+
+    def schedule(self, key: int, when: datetime) -> None:
+        deadline = when.timestamp()
+        self._deadlines[key] = deadline
+        heappush(self._heap, (deadline, next(self._counter), key))
+        if self._heap[0][2] == key:
+            self._wakeup.set()
+
+    def cancel(self, key: int) -> None:
+        self._deadlines.pop(key, None)
+
+    def start(self) -> None:
+        if self._future:
+            self._future.cancel()
+        self._future = ensure_future(self.run())
+
+    async def run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            await self.fire()
+
+            timeout = max(self._heap[0][0] - time(), 0) if self._heap else None
+            try:
+                await wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    async def fire(self) -> None:
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            # Rescheduled or canceled keys leave stale entries behind.
+            if self._deadlines.get(key) != deadline:
+                heappop(self._heap)
+                continue
+            if deadline > time():
+                return
+
+            heappop(self._heap)
+            del self._deadlines[key]
+            try:
+                await self.callback(key)
+            except Exception as e:
+                error(f"Error in scheduled callback ({key}): {e}")
+
+    async def close(self) -> None:
+        if self._future:
+            self._future.cancel()
+            try:
+                await self._future
+            except CancelledError:
+                pass
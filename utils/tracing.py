@@ -0,0 +1,125 @@
+from asyncio import Future, gather, get_running_loop
+from contextlib import contextmanager
+from contextvars import ContextVar
+from json import dumps
+from logging import error, warning
+from time import perf_counter, time
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from utils.config import Config
+
+
+class Span:
+    def __init__(self, name: str, start: Optional[float] = None) -> None:
+        self.name = name
+        self.origin: Optional[str] = None
+        self.error: Optional[str] = None
+        self.children: List[Span] = []
+
+        now = perf_counter()
+        self._start = now if start is None else start
+        self._end: Optional[float] = None
+        self.started_at = time() - (now - self._start)
+
+    def finish(self) -> None:
+        self._end = perf_counter()
+
+    @property
+    def duration(self) -> float:
+        return ((self._end or perf_counter()) - self._start) * 1000
+
+    def breakdown(self, depth: int = 0) -> List[str]:
+        line = f"{'  ' * depth}{self.name}: {self.duration:.1f}ms"
+        if self.error:
+            line += f" ({self.error})"
+        lines = [line]
+        for child in self.children:
+            lines.extend(child.breakdown(depth + 1))
+        return lines
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "origin": self.origin,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration, 3),
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_current_trace: ContextVar[Optional[Span]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Span]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, start: Optional[float] = None) -> Iterator[Optional[Span]]:
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, start)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.error = repr(e)
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+class Tracer:
+    def __init__(self, config: Config) -> None:
+        self.threshold = config.trace_threshold
+        self.export = config.trace_export
+        self._exports: Set[Future] = set()
+
+    @contextmanager
+    def trace(
+        self, name: str, start: Optional[float] = None, origin: Optional[str] = None
+    ) -> Iterator[Span]:
+        root = Span(name, start)
+        root.origin = origin
+        token = _current_span.set(root)
+        trace_token = _current_trace.set(root)
+        try:
+            yield root
+        except Exception as e:
+            root.error = repr(e)
+            raise
+        finally:
+            root.finish()
+            _current_trace.reset(trace_token)
+            _current_span.reset(token)
+            self.report(root)
+
+    def report(self, root: Span) -> None:
+        if root.duration >= self.threshold:
+            origin = f" from {root.origin}" if root.origin else ""
+            breakdown = "\n".join(root.breakdown())
+            warning(f"Slow trace{origin} ({root.duration:.1f}ms):\n{breakdown}")
+
+        if self.export:
+            line = dumps(root.to_dict())
+            future = get_running_loop().run_in_executor(None, self.write, line)
+            self._exports.add(future)
+            future.add_done_callback(self._exports.discard)
+
+    async def close(self) -> None:
+        if self._exports:
+            await gather(*self._exports)
+
+    def write(self, line: str) -> None:
+        try:
+            with open(self.export, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+        except OSError as e:
+            error(f"Failed to export trace: {e}")
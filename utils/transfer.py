@@ -0,0 +1,151 @@
+from csv import DictReader, DictWriter
+from datetime import datetime
+from enum import Enum
+from itertools import islice
+from json import dumps, loads
+from logging import warning
+from typing import (Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional,
+                    TextIO, Tuple)
+
+from tortoise.transactions import in_transaction
+
+from utils.models import Connection
+
+FIELDS = (
+    "user_id",
+    "username",
+    "is_banned",
+    "ban_reason",
+    "expires_at",
+    "ban_expires_at",
+    "created_at",
+)
+DATETIME_FIELDS = ("expires_at", "ban_expires_at", "created_at")
+
+
+class Conflict(Enum):
+    SKIP = "skip"
+    UPDATE = "update"
+    FAIL = "fail"
+
+
+class ConflictError(Exception):
+    pass
+
+
+def chunked(rows: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def encode(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        field: value.isoformat() if isinstance(value, datetime) else value
+        for field, value in row.items()
+    }
+
+
+def decode(row: Dict[str, Any]) -> Dict[str, Any]:
+    # CSV rows only hold strings, JSON rows keep their types.
+    decoded = {field: row.get(field) or None for field in FIELDS}
+    decoded["user_id"] = int(decoded["user_id"])
+    if isinstance(is_banned := decoded["is_banned"], str):
+        is_banned = is_banned.lower() in ("true", "1")
+    decoded["is_banned"] = bool(is_banned)
+    for field in DATETIME_FIELDS:
+        if isinstance(value := decoded[field], str):
+            decoded[field] = datetime.fromisoformat(value)
+    if decoded["created_at"] is None:
+        del decoded["created_at"]
+    return decoded
+
+
+async def iter_connections(chunk_size: int) -> AsyncIterator[Dict[str, Any]]:
+    last_id = 0
+    while True:
+        query = Connection.filter(id__gt=last_id).order_by("id").limit(chunk_size)
+        if not (rows := await query.values("id", *FIELDS)):
+            return
+        for row in rows:
+            last_id = row.pop("id")
+            yield row
+
+
+def read_jsonl(file: TextIO) -> Iterator[Dict[str, Any]]:
+    for line in file:
+        if line.strip():
+            yield decode(loads(line))
+
+
+def read_csv(file: TextIO) -> Iterator[Dict[str, Any]]:
+    for row in DictReader(file):
+        yield decode(row)
+
+
+async def export_connections(file: TextIO, fmt: str, chunk_size: int) -> int:
+    writer: Optional[DictWriter] = None
+    if fmt == "csv":
+        writer = DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+
+    count = 0
+    async for row in iter_connections(chunk_size):
+        if writer:
+            writer.writerow(encode(row))
+        else:
+            file.write(dumps(encode(row)) + "\n")
+        count += 1
+    return count
+
+
+async def import_connections(
+    rows: Iterable[Dict[str, Any]], chunk_size: int, conflict: Conflict
+) -> Tuple[int, int, int]:
+    created = updated = skipped = 0
+    for batch in chunked(rows, chunk_size):
+        async with in_transaction():
+            existing = {
+                connection.user_id: connection
+                for connection in await Connection.filter(
+                    user_id__in=[row["user_id"] for row in batch]
+                )
+            }
+            owners = dict(
+                await Connection.filter(
+                    username__in=[row["username"] for row in batch if row["username"]]
+                ).values_list("username", "user_id")
+            )
+
+            creates: Dict[int, Connection] = {}
+            updates: Dict[int, Connection] = {}
+            for row in batch:
+                user_id = row["user_id"]
+                username = row["username"]
+                if owners.get(username, user_id) != user_id:
+                    warning(f"Skipping {user_id}: {username} belongs to another user.")
+                    skipped += 1
+                    continue
+
+                if connection := existing.get(user_id):
+                    if conflict == Conflict.FAIL:
+                        raise ConflictError(f"Connection {user_id} already exists.")
+                    if conflict == Conflict.SKIP:
+                        skipped += 1
+                        continue
+                    connection.update_from_dict(row)
+                    if user_id not in creates:
+                        updates[user_id] = connection
+                else:
+                    existing[user_id] = creates[user_id] = Connection(**row)
+                if username:
+                    owners[username] = user_id
+
+            if creates:
+                await Connection.bulk_create(list(creates.values()))
+            if updates:
+                fields = [field for field in FIELDS if field != "user_id"]
+                await Connection.bulk_update(list(updates.values()), fields=fields)
+            created += len(creates)
+            updated += len(updates)
+    return created, updated, skipped
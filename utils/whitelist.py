@@ -0,0 +1,85 @@
+from asyncio import get_running_loop
+from hashlib import md5
+from json import dump, load
+from logging import error, warning
+from os import fdopen, fsync, replace, unlink
+from pathlib import Path
+from tempfile import mkstemp
+from typing import Dict, List
+from uuid import UUID
+
+from aiohttp import ClientError, ClientSession
+from tortoise.queryset import Q
+
+from utils.config import Config
+from utils.models import Connection
+
+PROFILES_URL = "https://api.mojang.com/profiles/minecraft"
+PROFILES_BATCH = 10
+
+
+def offline_uuid(username: str) -> str:
+    digest = md5(f"OfflinePlayer:{username}".encode()).digest()
+    return str(UUID(bytes=digest, version=3))
+
+
+class WhitelistFile:
+    def __init__(self, config: Config) -> None:
+        self.path = Path(config.server_dir) / "whitelist.json"
+        self.online_mode = config.online_mode
+
+    def read(self) -> Dict[str, str]:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return {entry["name"].lower(): entry["uuid"] for entry in load(file)}
+        except FileNotFoundError:
+            return {}
+
+    def write(self, entries: List[Dict[str, str]]) -> None:
+        fd, temp = mkstemp(dir=self.path.parent, prefix=".whitelist.", suffix=".tmp")
+        try:
+            with fdopen(fd, "w", encoding="utf-8") as file:
+                dump(entries, file, indent=2)
+                file.flush()
+                fsync(file.fileno())
+            replace(temp, self.path)
+        except BaseException:
+            unlink(temp)
+            raise
+
+    async def lookup(self, usernames: List[str]) -> Dict[str, str]:
+        if not self.online_mode:
+            return {username.lower(): offline_uuid(username) for username in usernames}
+
+        uuids = {}
+        async with ClientSession() as session:
+            for i in range(0, len(usernames), PROFILES_BATCH):
+                batch = usernames[i : i + PROFILES_BATCH]
+                try:
+                    async with session.post(PROFILES_URL, json=batch) as response:
+                        response.raise_for_status()
+                        for profile in await response.json():
+                            uuids[profile["name"].lower()] = str(UUID(profile["id"]))
+                except ClientError as e:
+                    error(f"Failed to look up profiles {batch}: {e}")
+        return uuids
+
+    async def sync(self) -> int:
+        usernames: List[str] = await Connection.filter(
+            ~Q(username=None) & Q(is_banned=False)
+        ).values_list("username", flat=True)
+
+        loop = get_running_loop()
+        uuids = await loop.run_in_executor(None, self.read)
+        if missing := [name for name in usernames if name.lower() not in uuids]:
+            uuids.update(await self.lookup(missing))
+
+        entries = []
+        for username in usernames:
+            if uuid := uuids.get(username.lower()):
+                entries.append({"uuid": uuid, "name": username})
+            else:
+                warning(f"Skipping unknown Minecraft profile {username}.")
+
+        await loop.run_in_executor(None, self.write, entries)
+        return len(entries)